@@ -25,7 +25,7 @@ def _get_bool(name: str, default: bool) -> bool:
     return value.lower() in {"1", "true", "yes", "on"}
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Settings:
     port: int = 8080
     whisper_api_base: str = "https://api.whisper-api.com"
@@ -39,38 +39,37 @@ class Settings:
     rpm_per_tenant: int = 120
     concurrent_user: int = 1
     concurrent_tenant: int = 5
-
-    minutes_per_day: int = 120
-    minutes_per_month: int = 0
-
     minutes_per_day: int = 60
     minutes_per_month: int = 1200
-
     default_model: str = "large-v3"
     allow_diarization: bool = False
 
-    def __post_init__(self) -> None:
-        self.port = _get_int("PORT", self.port)
-        self.whisper_api_base = _get_env("WHISPER_API_BASE", self.whisper_api_base)
-        self.whisper_api_key = _get_env("WHISPER_API_KEY", self.whisper_api_key)
-        self.firebase_project_id = _get_env("FIREBASE_PROJECT_ID", self.firebase_project_id)
-        self.limiter_backend = _get_env("LIMITER_BACKEND", self.limiter_backend)
-        self.redis_url = os.getenv("REDIS_URL", self.redis_url)
-        self.max_file_mb = _get_int("MAX_FILE_MB", self.max_file_mb)
-        self.max_clip_min = _get_int("MAX_CLIP_MIN", self.max_clip_min)
-        self.rpm_per_user = _get_int("RPM_PER_USER", self.rpm_per_user)
-        self.rpm_per_tenant = _get_int("RPM_PER_TENANT", self.rpm_per_tenant)
-        self.concurrent_user = _get_int("CONCURRENT_USER", self.concurrent_user)
-        self.concurrent_tenant = _get_int("CONCURRENT_TENANT", self.concurrent_tenant)
-        self.minutes_per_day = _get_int("MINUTES_PER_DAY", self.minutes_per_day)
-        self.minutes_per_month = _get_int("MINUTES_PER_MONTH", self.minutes_per_month)
-        self.default_model = _get_env("DEFAULT_MODEL", self.default_model)
-        self.allow_diarization = _get_bool("ALLOW_DIARIZATION", self.allow_diarization)
+    @classmethod
+    def from_env(cls) -> Settings:
+        defaults = cls()
+        return cls(
+            port=_get_int("PORT", defaults.port),
+            whisper_api_base=_get_env("WHISPER_API_BASE", defaults.whisper_api_base),
+            whisper_api_key=_get_env("WHISPER_API_KEY", defaults.whisper_api_key),
+            firebase_project_id=_get_env("FIREBASE_PROJECT_ID", defaults.firebase_project_id),
+            limiter_backend=_get_env("LIMITER_BACKEND", defaults.limiter_backend),
+            redis_url=os.getenv("REDIS_URL", defaults.redis_url),
+            max_file_mb=_get_int("MAX_FILE_MB", defaults.max_file_mb),
+            max_clip_min=_get_int("MAX_CLIP_MIN", defaults.max_clip_min),
+            rpm_per_user=_get_int("RPM_PER_USER", defaults.rpm_per_user),
+            rpm_per_tenant=_get_int("RPM_PER_TENANT", defaults.rpm_per_tenant),
+            concurrent_user=_get_int("CONCURRENT_USER", defaults.concurrent_user),
+            concurrent_tenant=_get_int("CONCURRENT_TENANT", defaults.concurrent_tenant),
+            minutes_per_day=_get_int("MINUTES_PER_DAY", defaults.minutes_per_day),
+            minutes_per_month=_get_int("MINUTES_PER_MONTH", defaults.minutes_per_month),
+            default_model=_get_env("DEFAULT_MODEL", defaults.default_model),
+            allow_diarization=_get_bool("ALLOW_DIARIZATION", defaults.allow_diarization),
+        )
 
 
 @lru_cache
 def get_settings() -> Settings:
-    return Settings()
+    return Settings.from_env()
 
 
 settings = get_settings()
@@ -2,9 +2,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from typing import Any, Callable
 
+# Uploads up to this size stay in memory; larger ones spill to a temp file.
+_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
 
 class HTTPException(Exception):
     def __init__(self, status_code: int, detail: Any | None = None) -> None:
@@ -31,18 +34,28 @@ def Header(default: Any = None, alias: str | None = None) -> Any:  # pragma: no
 
 
 class Request:  # pragma: no cover - minimal request stub
-    def __init__(self, headers: dict[str, str] | None = None) -> None:
+    def __init__(self, headers: dict[str, str] | None = None, form: dict[str, Any] | None = None) -> None:
         self.headers = headers or {}
+        self._form = form or {}
+
+    async def form(self) -> dict[str, Any]:
+        return self._form
 
 
 class UploadFile:
     def __init__(self, filename: str, content: bytes, content_type: str | None = None) -> None:
         self.filename = filename
         self.content_type = content_type
-        self._buffer = BytesIO(content)
+        self.file = SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+        self.file.write(content)
+        self.file.seek(0)
+        self.size = len(content)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
 
-    async def read(self) -> bytes:
-        return self._buffer.getvalue()
+    async def seek(self, offset: int) -> None:
+        self.file.seek(offset)
 
 
 class _State:
@@ -54,7 +67,7 @@ class FastAPI:
         self.routes: dict[tuple[str, str], Callable[..., Any]] = {}
         self.state = _State()
 
-    def post(self, path: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def post(self, path: str, **kwargs: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
         def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
             self.routes[("POST", path)] = func
             return func
@@ -1,6 +1,7 @@
 """Minimal response types for FastAPI stubs."""
 from __future__ import annotations
 
+import json
 from typing import Any
 
 
@@ -11,3 +12,17 @@ class JSONResponse:
 
     def json(self) -> Any:
         return self.content
+
+
+class ORJSONResponse(JSONResponse):
+    pass
+
+
+class Response:
+    def __init__(self, content: bytes | str = b"", status_code: int = 200, media_type: str | None = None) -> None:
+        self.body = content.encode("utf-8") if isinstance(content, str) else content
+        self.status_code = status_code
+        self.media_type = media_type
+
+    def json(self) -> Any:
+        return json.loads(self.body)
@@ -1,90 +1,142 @@
 """Rate limiting utilities using a token bucket strategy."""
 from __future__ import annotations
 
-import asyncio
 import time
-from typing import Protocol
+from typing import TYPE_CHECKING, Protocol
 
 try:  # pragma: no cover - prefer real redis client
     import redis.asyncio as redis
+    from redis.exceptions import NoScriptError
 except ImportError:  # pragma: no cover - offline stub
-    class _DummyRedis:
-        def __init__(self, *args, **kwargs) -> None:
-            pass
-
-        async def eval(self, *args, **kwargs) -> int:
-            return 1
-
-    class redis:  # type: ignore
-        @staticmethod
-        def from_url(url: str):
-            return _DummyRedis()
+    if not TYPE_CHECKING:  # keep mypy/mypyc on the real client's types
+        from . import redis_stub as redis
+        from .redis_stub import NoScriptError
 
 
 class LimiterBackend(Protocol):
     async def allow(self, key: str, rate: int, cost: int = 1, window_seconds: int = 60) -> bool:
         ...
 
+    async def allow_many(
+        self, keys_and_rates: list[tuple[str, int]], cost: int = 1, window_seconds: int = 60
+    ) -> list[bool]:
+        ...
+
 
 class InMemoryTokenBucket:
-    """Simple in-memory token bucket for low traffic deployments."""
+    """Simple in-memory token bucket for low traffic deployments.
 
-    def __init__(self) -> None:
-        self._buckets: dict[str, tuple[float, float]] = {}
-        self._lock = asyncio.Lock()
+    Implemented as GCRA: each key stores only its theoretical arrival time
+    (TAT). A hit pushes the TAT forward by ``cost`` emission intervals and is
+    allowed while the TAT stays within one window of ``now``, which is
+    equivalent to a bucket holding ``rate`` tokens refilled over the window.
 
-    async def allow(self, key: str, rate: int, cost: int = 1, window_seconds: int = 60) -> bool:
-        now = time.monotonic()
-        capacity = float(rate)
-        refill_rate = capacity / window_seconds
-        async with self._lock:
-            tokens, last = self._buckets.get(key, (capacity, now))
-            tokens = min(capacity, tokens + (now - last) * refill_rate)
-            allowed = tokens >= cost
-            if allowed:
-                tokens -= cost
-            self._buckets[key] = (tokens, now)
-        return allowed
+    The bucket is only touched from a single event loop and the update step
+    contains no ``await``, so it cannot interleave with other coroutines and
+    needs no lock.
+    """
 
+    def __init__(self) -> None:
+        self._buckets: dict[str, int] = {}
 
+    async def allow(self, key: str, rate: int, cost: int = 1, window_seconds: int = 60) -> bool:
+        return (await self.allow_many([(key, rate)], cost, window_seconds))[0]
+
+    async def allow_many(
+        self, keys_and_rates: list[tuple[str, int]], cost: int = 1, window_seconds: int = 60
+    ) -> list[bool]:
+        """Charge every bucket or none; returns which buckets had room."""
+
+        # Integer nanoseconds keep the boundary comparison exact.
+        now = time.monotonic_ns()
+        window = window_seconds * 1_000_000_000
+        results: list[bool] = []
+        new_tats: list[int] = []
+        for key, rate in keys_and_rates:
+            tat = self._buckets.get(key, now)
+            if rate <= 0:
+                # A zero rate means the scope is closed, not unlimited.
+                results.append(False)
+                new_tats.append(tat)
+                continue
+            new_tat = (tat if tat > now else now) + cost * window // rate
+            results.append(new_tat - now <= window)
+            new_tats.append(new_tat)
+        if all(results):
+            for (key, _), new_tat in zip(keys_and_rates, new_tats):
+                self._buckets[key] = new_tat
+        return results
+
+
+# KEYS: bucket keys; ARGV: window, cost, then one rate per key.
+# Buckets are charged only when every one of them has room.
 REDIS_SCRIPT = """
-local bucket_key = KEYS[1]
-local now = tonumber(ARGV[1])
-local rate = tonumber(ARGV[2])
-local window = tonumber(ARGV[3])
-local cost = tonumber(ARGV[4])
-local capacity = rate
-local refill = capacity / window
-local data = redis.call('HMGET', bucket_key, 'tokens', 'timestamp')
-local tokens = tonumber(data[1])
-local last = tonumber(data[2])
-if tokens == nil then
-  tokens = capacity
-  last = now
-else
-  tokens = math.min(capacity, tokens + (now - last) * refill)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+local window = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local tokens = {}
+local result = {}
+local allowed = true
+for i, bucket_key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i + 2])
+  local refill = capacity / window
+  local data = redis.call('HMGET', bucket_key, 'tokens', 'timestamp')
+  local available = tonumber(data[1]) or capacity
+  local last = tonumber(data[2]) or now
+  available = math.min(capacity, available + (now - last) * refill)
+  tokens[i] = available
+  if available >= cost then
+    result[i] = 1
+  else
+    result[i] = 0
+    allowed = false
+  end
 end
-local allowed = 0
-if tokens >= cost then
-  allowed = 1
-  tokens = tokens - cost
+for i, bucket_key in ipairs(KEYS) do
+  local remaining = tokens[i]
+  if allowed then
+    remaining = remaining - cost
+  end
+  redis.call('HSET', bucket_key, 'tokens', remaining, 'timestamp', now)
+  redis.call('EXPIRE', bucket_key, window)
 end
-redis.call('HMSET', bucket_key, 'tokens', tokens, 'timestamp', now)
-redis.call('EXPIRE', bucket_key, window)
-return allowed
+return result
 """
 
 
 class RedisTokenBucket:
-    """Redis backed token bucket for multi-process deployments."""
+    """Redis backed token bucket for multi-process deployments.
+
+    The script is registered once with ``SCRIPT LOAD`` and invoked by SHA; the
+    clock is read inside the script so every app process shares Redis' time.
+    Several buckets can be checked in one round trip with ``allow_many``.
+    """
 
     def __init__(self, client: redis.Redis) -> None:
         self._client = client
+        self._sha: str | None = None
+
+    async def load_script(self) -> str:
+        self._sha = await self._client.script_load(REDIS_SCRIPT)
+        return self._sha
 
     async def allow(self, key: str, rate: int, cost: int = 1, window_seconds: int = 60) -> bool:
-        now = time.monotonic()
-        result = await self._client.eval(REDIS_SCRIPT, 1, key, now, rate, window_seconds, cost)
-        return bool(result)
+        return (await self.allow_many([(key, rate)], cost, window_seconds))[0]
+
+    async def allow_many(
+        self, keys_and_rates: list[tuple[str, int]], cost: int = 1, window_seconds: int = 60
+    ) -> list[bool]:
+        sha = self._sha or await self.load_script()
+        keys = [key for key, _ in keys_and_rates]
+        args = [window_seconds, cost, *[rate for _, rate in keys_and_rates]]
+        try:
+            result = await self._client.evalsha(sha, len(keys), *keys, *args)
+        except NoScriptError:
+            # Script cache was flushed (restart/failover): run inline and re-register.
+            result = await self._client.eval(REDIS_SCRIPT, len(keys), *keys, *args)
+            await self.load_script()
+        return [bool(flag) for flag in result]
 
 
 class RateLimiter:
@@ -96,11 +148,16 @@ class RateLimiter:
     async def hit(self, scope: str, rate: int) -> bool:
         return await self._backend.allow(scope, rate)
 
+    async def hit_many(self, scopes: list[tuple[str, int]]) -> list[bool]:
+        return await self._backend.allow_many(scopes)
+
 
 async def create_limiter(backend: str, redis_url: str | None) -> RateLimiter:
     """Factory returning a rate limiter instance."""
 
     if backend == "redis" and redis_url:
         client = redis.from_url(redis_url)
-        return RateLimiter(RedisTokenBucket(client))
+        bucket = RedisTokenBucket(client)
+        await bucket.load_script()
+        return RateLimiter(bucket)
     return RateLimiter(InMemoryTokenBucket())
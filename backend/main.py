@@ -2,10 +2,12 @@
 from __future__ import annotations
 
 import asyncio
-import io
+import hashlib
 import math
 import time
 import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from typing import Any, Dict
 
 try:  # pragma: no cover - used for runtime, tests patch the client
@@ -15,8 +17,10 @@ except ImportError:  # pragma: no cover - fallback for offline testing
         ...
 
     class _StubHTTPStatusError(_StubHTTPError):
-        def __init__(self, *args, **kwargs) -> None:
+        def __init__(self, *args, request: Any = None, response: Any = None) -> None:
             super().__init__(*args)
+            self.request = request
+            self.response = response
 
     class _StubAsyncClient:
         def __init__(self, *args, **kwargs) -> None:
@@ -31,18 +35,23 @@ except ImportError:  # pragma: no cover - fallback for offline testing
         async def aclose(self) -> None:
             return None
 
+    class _StubLimits:
+        def __init__(self, *args, **kwargs) -> None:
+            pass
+
     class _StubHttpxModule:  # minimal interface for tests
         AsyncClient = _StubAsyncClient
+        Limits = _StubLimits
         HTTPError = _StubHTTPError
         HTTPStatusError = _StubHTTPStatusError
 
     httpx = _StubHttpxModule()  # type: ignore
 try:  # pragma: no cover - prefer real FastAPI when available
-    from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
-    from fastapi.responses import JSONResponse
+    from fastapi import Depends, FastAPI, Header, HTTPException, Request, UploadFile
+    from fastapi.responses import JSONResponse, ORJSONResponse, Response
 except ImportError:  # pragma: no cover - offline test fallback
-    from .fastapi_stub import Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
-    from .fastapi_stub_responses import JSONResponse
+    from .fastapi_stub import Depends, FastAPI, Header, HTTPException, Request, UploadFile
+    from .fastapi_stub_responses import JSONResponse, ORJSONResponse, Response
 try:  # pragma: no cover - prefer real google-auth
     from google.auth.transport import requests as google_requests
     from google.oauth2 import id_token
@@ -60,15 +69,46 @@ except ImportError:  # pragma: no cover - offline fallback
     google_requests = _DummyRequestModule()  # type: ignore
     id_token = _DummyIdToken()  # type: ignore
 
-from config import get_settings
-from limiter import RateLimiter, create_limiter
-from usage_store import usage_store
+try:  # pragma: no cover - prefer orjson for response encoding
+    import orjson
+except ImportError:  # pragma: no cover - offline fallback
+    import json
 
-app = FastAPI(title="Whisper Proxy")
+    class _StubOrjsonModule:
+        @staticmethod
+        def dumps(obj: Any) -> bytes:
+            return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+    orjson = _StubOrjsonModule()  # type: ignore
+    ORJSONResponse = JSONResponse  # type: ignore  # ORJSONResponse needs orjson
+
+try:  # package import (uvicorn backend.main:app, tests)
+    from .config import get_settings
+    from .limiter import RateLimiter, create_limiter
+    from .usage_store import usage_store
+except ImportError:  # pragma: no cover - run from inside backend/ (uvicorn main:app)
+    from config import get_settings
+    from limiter import RateLimiter, create_limiter
+    from usage_store import usage_store
+
+app = FastAPI(title="Whisper Proxy", default_response_class=ORJSONResponse)
 settings = get_settings()
 _google_request = google_requests.Request()
-_idem_lock = asyncio.Lock()
-_idem_cache: dict[tuple[str, str], dict[str, Any]] = {}
+_EXPECTED_ISSUER = f"https://securetoken.google.com/{settings.firebase_project_id}"
+_IDEM_TTL_SECONDS = 24 * 60 * 60
+_IDEM_MAX_ENTRIES = 10_000
+_idem_cache: OrderedDict[tuple[str, str], tuple[float, dict[str, Any]]] = OrderedDict()
+_idem_inflight: dict[tuple[str, str], asyncio.Event] = {}
+_TOKEN_CACHE_MAX_ENTRIES = 10_000
+_token_cache: OrderedDict[bytes, tuple[float, dict[str, Any]]] = OrderedDict()
+_limits_json_cache: tuple[Any, bytes] | None = None
+_UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Uncompressed audio is ~5x larger per minute than the compressed formats.
+_PCM_EXTS = (".wav", ".pcm")
+_WAV_CT_SUFFIX = "wav"
+# Same spellings FastAPI/pydantic accept for a ``Form(bool)`` field.
+_FORM_TRUE_VALUES = frozenset({"1", "on", "t", "true", "y", "yes"})
+_FORM_FALSE_VALUES = frozenset({"0", "off", "f", "false", "n", "no"})
 
 
 async def get_limiter() -> RateLimiter:
@@ -79,14 +119,30 @@ async def get_limiter() -> RateLimiter:
     return limiter
 
 
+def _create_http_client() -> httpx.AsyncClient:
+    # Single upstream: keep connections warm and multiplex requests over HTTP/2.
+    return httpx.AsyncClient(
+        base_url=settings.whisper_api_base,
+        timeout=120,
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60),
+    )
+
+
 async def get_http_client() -> httpx.AsyncClient:
     client = getattr(app.state, "http_client", None)
     if client is None:
-        client = httpx.AsyncClient(base_url=settings.whisper_api_base, timeout=120)
+        client = _create_http_client()
         app.state.http_client = client
     return client
 
 
+@app.on_event("startup")
+async def startup_event() -> None:
+    if getattr(app.state, "http_client", None) is None:
+        app.state.http_client = _create_http_client()
+
+
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
     client = getattr(app.state, "http_client", None)
@@ -95,54 +151,145 @@ async def shutdown_event() -> None:
 
 
 def _extract_token(auth_header: str | None) -> str:
-    if not auth_header or not auth_header.startswith("Bearer "):
+    if not auth_header or auth_header[:7] != "Bearer ":
         raise HTTPException(status_code=401, detail="missing_token")
-    return auth_header.split(" ", 1)[1]
+    return auth_header[7:]
 
 
-def verify_firebase_token(auth_header: str | None) -> dict[str, Any]:
+async def verify_firebase_token(auth_header: str | None) -> dict[str, Any]:
     token = _extract_token(auth_header)
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = _token_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Signature verification is CPU-bound; keep it off the event loop.
+    loop = asyncio.get_running_loop()
     try:
-        decoded = id_token.verify_oauth2_token(token, _google_request)
+        decoded = await loop.run_in_executor(None, id_token.verify_oauth2_token, token, _google_request)
     except Exception as exc:  # pragma: no cover - defensive
         raise HTTPException(status_code=401, detail="invalid_token") from exc
 
-    project_id = settings.firebase_project_id
-    if decoded.get("aud") != project_id:
+    decoded_get = decoded.get
+    if decoded_get("aud") != settings.firebase_project_id:
         raise HTTPException(status_code=401, detail="invalid_audience")
-    issuer = decoded.get("iss")
-    expected_issuer = f"https://securetoken.google.com/{project_id}"
-    if issuer and issuer != expected_issuer:
+    issuer = decoded_get("iss")
+    if issuer and issuer != _EXPECTED_ISSUER:
         raise HTTPException(status_code=401, detail="invalid_issuer")
     if "uid" not in decoded:
         raise HTTPException(status_code=401, detail="missing_uid")
+    _token_cache_put(cache_key, decoded)
+    return decoded
+
+
+def _token_cache_get(cache_key: bytes) -> dict[str, Any] | None:
+    entry = _token_cache.get(cache_key)
+    if entry is None:
+        return None
+    expires_at, decoded = entry
+    if time.time() >= expires_at:
+        del _token_cache[cache_key]
+        return None
+    _token_cache.move_to_end(cache_key)
     return decoded
 
 
+def _token_cache_put(cache_key: bytes, decoded: dict[str, Any]) -> None:
+    expires_at = decoded.get("exp")
+    if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+        return
+    _token_cache[cache_key] = (float(expires_at), decoded)
+    _token_cache.move_to_end(cache_key)
+    while len(_token_cache) > _TOKEN_CACHE_MAX_ENTRIES:
+        _token_cache.popitem(last=False)
+
+
 def _tenant_id(decoded: dict[str, Any]) -> str:
-    firebase_info = decoded.get("firebase", {})
-    return firebase_info.get("tenant") or decoded.get("tenant_id") or settings.firebase_project_id
+    firebase_info = decoded.get("firebase")
+    tenant = firebase_info.get("tenant") if firebase_info else None
+    return tenant or decoded.get("tenant_id") or settings.firebase_project_id
+
+
+async def _upload_size(file: UploadFile, max_bytes: int) -> int:
+    """Return the upload size without materialising it, stopping past the cap."""
+
+    size = getattr(file, "size", None)
+    if size is not None:
+        return size
+    size = 0
+    while size <= max_bytes:
+        chunk = await file.read(_UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+    await file.seek(0)
+    return size
+
+
+class _UploadStream:
+    """Read-only view of an upload's file for httpx ``files=``.
+
+    httpx sizes file fields with ``os.fstat(fileno())``, which makes a
+    SpooledTemporaryFile roll its in-memory buffer over to disk. Without
+    ``fileno`` httpx measures the length with seek/tell instead.
+    """
+
+    __slots__ = ("_file",)
+
+    def __init__(self, file: Any) -> None:
+        self._file = file
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
 
 
 def _estimate_minutes(filename: str | None, content_type: str | None, size_bytes: int) -> int:
-    mb = max(1, math.ceil(size_bytes / (1024 * 1024)))
+    # Integer ceil-divisions; mb >= 1 keeps the result >= 1.
+    mb = max(1, (size_bytes + (1 << 20) - 1) >> 20)
     lower = (filename or "").lower()
-    ratio = 5 if lower.endswith((".wav", ".pcm")) or (content_type or "").endswith("wav") else 1
-    minutes = max(1, math.ceil(mb / ratio))
-    return minutes
+    ratio = 5 if lower.endswith(_PCM_EXTS) or (content_type or "").endswith(_WAV_CT_SUFFIX) else 1
+    return (mb + ratio - 1) // ratio
 
 
 async def _enforce_limits(user_id: str, tenant_id: str, limiter: RateLimiter) -> None:
-    user_key = f"user:{user_id}"
-    tenant_key = f"tenant:{tenant_id}"
-    allowed_user = await limiter.hit(user_key, settings.rpm_per_user)
+    # Both keys share the {tenant_id} hash tag so Redis Cluster maps them to
+    # one slot and the limiter script can check them together.
+    user_key = f"{{{tenant_id}}}:rl:user:{user_id}"
+    tenant_key = f"{{{tenant_id}}}:rl:tenant"
+    allowed_user, allowed_tenant = await limiter.hit_many(
+        [(user_key, settings.rpm_per_user), (tenant_key, settings.rpm_per_tenant)]
+    )
     if not allowed_user:
         raise HTTPException(status_code=429, detail="rate_limited_user")
-    allowed_tenant = await limiter.hit(tenant_key, settings.rpm_per_tenant)
     if not allowed_tenant:
         raise HTTPException(status_code=429, detail="rate_limited_tenant")
 
 
+def _idem_get(cache_key: tuple[str, str]) -> dict[str, Any] | None:
+    entry = _idem_cache.get(cache_key)
+    if entry is None:
+        return None
+    stored_at, payload = entry
+    if time.monotonic() - stored_at >= _IDEM_TTL_SECONDS:
+        del _idem_cache[cache_key]
+        return None
+    _idem_cache.move_to_end(cache_key)
+    return payload
+
+
+def _idem_put(cache_key: tuple[str, str], payload: dict[str, Any]) -> None:
+    _idem_cache[cache_key] = (time.monotonic(), payload)
+    _idem_cache.move_to_end(cache_key)
+    while len(_idem_cache) > _IDEM_MAX_ENTRIES:
+        _idem_cache.popitem(last=False)
+
+
 def _limits_dict() -> dict[str, int | bool | str]:
     return {
         "max_file_mb": settings.max_file_mb,
@@ -158,34 +305,151 @@ def _limits_dict() -> dict[str, int | bool | str]:
     }
 
 
-@app.post("/v1/transcribe")
+def _limits_json() -> bytes:
+    # /v1/me/usage splices this pre-encoded fragment into its body; it is
+    # re-encoded only when ``settings`` is replaced (Settings is frozen).
+    global _limits_json_cache
+    cached = _limits_json_cache
+    if cached is None or cached[0] is not settings:
+        cached = _limits_json_cache = (settings, orjson.dumps(_limits_dict()))
+    return cached[1]
+
+
+def _form_bool(form: Any, name: str) -> bool:
+    value = form.get(name)
+    if value is None or value == "":
+        return False
+    if isinstance(value, str):
+        lowered = value.lower()
+        if lowered in _FORM_TRUE_VALUES:
+            return True
+        if lowered in _FORM_FALSE_VALUES:
+            return False
+    raise HTTPException(status_code=422, detail=f"invalid_{name}")
+
+
+# The form is parsed by hand in TranscribeForm.from_request, so FastAPI cannot
+# derive the multipart body from the signature; describe it for OpenAPI here.
+_TRANSCRIBE_OPENAPI: dict[str, Any] = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "language": {"type": "string", "default": "th"},
+                        "format": {"type": "string", "default": "text"},
+                        "model_size": {"type": "string"},
+                        "word_timestamps": {"type": "boolean", "default": False},
+                        "diarization": {"type": "boolean", "default": False},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@dataclass(slots=True)
+class TranscribeForm:
+    """Multipart fields of ``POST /v1/transcribe``, parsed in a single pass."""
+
+    file: UploadFile
+    language: str = "th"
+    format: str = "text"
+    # Looked up per instance so a replaced ``settings`` takes effect.
+    model_size: str = field(default_factory=lambda: settings.default_model)
+    word_timestamps: bool = False
+    diarization: bool = False
+
+    @classmethod
+    async def from_request(cls, request: Request) -> TranscribeForm:
+        form = await request.form()
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            raise HTTPException(status_code=422, detail="missing_file")
+        if len(form) == 1:
+            # Common case: only the upload was sent, every option is a default.
+            return cls(file)
+        return cls(
+            file,
+            language=form.get("language") or "th",
+            format=form.get("format") or "text",
+            model_size=form.get("model_size") or settings.default_model,
+            word_timestamps=_form_bool(form, "word_timestamps"),
+            diarization=_form_bool(form, "diarization"),
+        )
+
+
+@app.post("/v1/transcribe", openapi_extra=_TRANSCRIBE_OPENAPI)
 async def transcribe(
-    request: Request,
-    file: UploadFile = File(...),
-    language: str = Form("th"),
-    format: str = Form("text"),
-    model_size: str = Form(default=settings.default_model),
-    word_timestamps: bool = Form(False),
-    diarization: bool = Form(False),
+    form: TranscribeForm = Depends(TranscribeForm.from_request),
     authorization: str | None = Header(default=None, alias="Authorization"),
     idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
     limiter: RateLimiter = Depends(get_limiter),
     client: httpx.AsyncClient = Depends(get_http_client),
-) -> JSONResponse:
+) -> ORJSONResponse:
     """Handle upload, enforce limits, proxy to Whisper API."""
 
-    decoded = verify_firebase_token(authorization)
+    decoded = await verify_firebase_token(authorization)
     user_id = decoded["uid"]
     tenant_id = _tenant_id(decoded)
 
-    if diarization and not settings.allow_diarization:
+    if form.diarization and not settings.allow_diarization:
         raise HTTPException(status_code=400, detail="diarization_not_allowed")
 
     await _enforce_limits(user_id, tenant_id, limiter)
 
-    content = await file.read()
-    size_bytes = len(content)
+    file = form.file
+    data = {
+        "language": form.language,
+        "format": form.format,
+        "model_size": form.model_size,
+        "word_timestamps": form.word_timestamps,
+        "diarization": form.diarization,
+    }
+    if not idempotency_key:
+        payload = await _submit_transcription(file, data, user_id, tenant_id, None, client)
+        return ORJSONResponse(payload)
+
+    # Replays are answered from the cache before any quota is reserved, and
+    # concurrent duplicates wait for the in-flight request instead of
+    # submitting the same upload twice.
+    cache_key = (user_id, idempotency_key)
+    while True:
+        cached = _idem_get(cache_key)
+        if cached:
+            return ORJSONResponse(cached)
+        inflight = _idem_inflight.get(cache_key)
+        if inflight is None:
+            break
+        await inflight.wait()
+
+    inflight = _idem_inflight[cache_key] = asyncio.Event()
+    try:
+        payload = await _submit_transcription(file, data, user_id, tenant_id, idempotency_key, client)
+        _idem_put(cache_key, payload)
+    finally:
+        del _idem_inflight[cache_key]
+        inflight.set()
+    return ORJSONResponse(payload)
+
+
+async def _submit_transcription(
+    file: UploadFile,
+    data: dict[str, Any],
+    user_id: str,
+    tenant_id: str,
+    idempotency_key: str | None,
+    client: httpx.AsyncClient,
+) -> dict[str, Any]:
+    """Check the upload, reserve quota and submit the job to Whisper."""
+
     max_bytes = settings.max_file_mb * 1024 * 1024
+    size_bytes = await _upload_size(file, max_bytes)
     if size_bytes > max_bytes:
         raise HTTPException(status_code=413, detail="file_too_large")
 
@@ -201,31 +465,17 @@ async def transcribe(
     }
 
     reservation_id = str(uuid.uuid4())
-    try:
-        await usage_store.reserve(user_id, tenant_id, estimated_minutes, reservation_id, limits)
-    except RuntimeError as exc:
-        reason = str(exc)
-        if reason.startswith("concurrency"):
-            raise HTTPException(status_code=409, detail=reason)
-        raise HTTPException(status_code=429, detail=reason)
-
-    if idempotency_key:
-        cache_key = (user_id, idempotency_key)
-        async with _idem_lock:
-            cached = _idem_cache.get(cache_key)
-            if cached:
-                await usage_store.rollback(reservation_id)
-                return JSONResponse(cached)
+    ok, reason = usage_store.reserve(tenant_id, user_id, estimated_minutes, reservation_id, limits)
+    if not ok:
+        raise HTTPException(status_code=409 if reason.startswith("concurrency") else 429, detail=reason)
 
-    data = {
-        "language": language,
-        "format": format,
-        "model_size": model_size,
-        "word_timestamps": word_timestamps,
-        "diarization": diarization,
-    }
+    await file.seek(0)
     files = {
-        "file": (file.filename or "upload", io.BytesIO(content), file.content_type or "application/octet-stream"),
+        "file": (
+            file.filename or "upload",
+            _UploadStream(file.file),
+            file.content_type or "application/octet-stream",
+        ),
     }
     headers = {"X-API-Key": settings.whisper_api_key}
     if idempotency_key:
@@ -235,23 +485,19 @@ async def transcribe(
         response = await client.post("/transcribe", data=data, files=files, headers=headers)
         response.raise_for_status()
     except httpx.HTTPStatusError as exc:
-        await usage_store.rollback(reservation_id)
+        usage_store.rollback(reservation_id)
         raise HTTPException(status_code=exc.response.status_code, detail="whisper_error") from exc
     except httpx.HTTPError as exc:  # pragma: no cover - network issues
-        await usage_store.rollback(reservation_id)
+        usage_store.rollback(reservation_id)
         raise HTTPException(status_code=502, detail="whisper_unreachable") from exc
 
     payload = response.json()
     task_id = payload.get("task_id")
     if not task_id:
-        await usage_store.rollback(reservation_id)
+        usage_store.rollback(reservation_id)
         raise HTTPException(status_code=502, detail="missing_task_id")
-    await usage_store.confirm(reservation_id, task_id)
-
-    if idempotency_key:
-        async with _idem_lock:
-            _idem_cache[(user_id, idempotency_key)] = payload
-    return JSONResponse(payload)
+    usage_store.confirm(reservation_id, task_id)
+    return payload
 
 
 @app.get("/v1/status/{task_id}")
@@ -260,8 +506,8 @@ async def status(
     authorization: str | None = Header(default=None, alias="Authorization"),
     limiter: RateLimiter = Depends(get_limiter),
     client: httpx.AsyncClient = Depends(get_http_client),
-) -> JSONResponse:
-    decoded = verify_firebase_token(authorization)
+) -> ORJSONResponse:
+    decoded = await verify_firebase_token(authorization)
     user_id = decoded["uid"]
     tenant_id = _tenant_id(decoded)
     await _enforce_limits(user_id, tenant_id, limiter)
@@ -281,23 +527,23 @@ async def status(
             minutes_actual = max(1, math.ceil(float(duration) / 60))
         else:
             minutes_actual = 1
-        await usage_store.commit(task_id, minutes_actual)
+        usage_store.commit(task_id, minutes_actual)
     elif status_value in {"failed", "cancelled"}:
-        await usage_store.rollback(task_id)
-    return JSONResponse(payload)
+        usage_store.rollback(task_id)
+    return ORJSONResponse(payload)
 
 
 @app.get("/v1/me/usage")
 async def me_usage(
     authorization: str | None = Header(default=None, alias="Authorization"),
-) -> JSONResponse:
-    decoded = verify_firebase_token(authorization)
+) -> Response:
+    decoded = await verify_firebase_token(authorization)
     user_id = decoded["uid"]
     tenant_id = _tenant_id(decoded)
-    usage = await usage_store.get_usage(user_id, tenant_id)
-    response = {
-        "minutes_today": usage["user"]["minutes_today"],
-        "minutes_month": usage["user"]["minutes_month"],
-        "limits": _limits_dict(),
-    }
-    return JSONResponse(response)
+    usage = usage_store.snapshot(tenant_id, user_id)
+    body = b'{"minutes_today":%d,"minutes_month":%d,"limits":%s}' % (
+        usage["minutes_today"],
+        usage["minutes_month"],
+        _limits_json(),
+    )
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,24 @@
+"""Minimal redis-py compatible stubs for offline testing."""
+from __future__ import annotations
+
+
+class NoScriptError(Exception):
+    ...
+
+
+class Redis:
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+    async def script_load(self, script: str) -> str:
+        return "0" * 40
+
+    async def eval(self, script: str, numkeys: int, *args) -> list[int]:
+        return [1] * numkeys
+
+    async def evalsha(self, sha: str, numkeys: int, *args) -> list[int]:
+        return [1] * numkeys
+
+
+def from_url(url: str) -> Redis:
+    return Redis()
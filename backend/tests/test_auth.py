@@ -1,5 +1,6 @@
 import asyncio
 import os
+import time
 
 os.environ.setdefault("WHISPER_API_KEY", "sk-live-example-1234567890")
 os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
@@ -7,10 +8,14 @@ os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
 import pytest
 
 from backend import main
-from backend.fastapi_stub import Request, UploadFile
-from backend.usage_store import usage_store
+from backend.fastapi_stub import UploadFile
+from backend.usage_store import UsageStore
 from backend.tests.utils import build_response
 
+MODEL = main.settings.default_model
+
+_verify_firebase_token = main.verify_firebase_token
+
 
 class FakeLimiter:
     def __init__(self) -> None:
@@ -19,6 +24,9 @@ class FakeLimiter:
     async def hit(self, scope: str, rate: int) -> bool:
         return self.allowed
 
+    async def hit_many(self, scopes):
+        return [self.allowed for _ in scopes]
+
 
 class FakeHTTPClient:
     def __init__(self) -> None:
@@ -43,16 +51,15 @@ class FakeHTTPClient:
 
 @pytest.fixture(autouse=True)
 def reset_state(monkeypatch):
-    usage_store._user_records.clear()
-    usage_store._tenant_records.clear()
-    usage_store._jobs.clear()
+    monkeypatch.setattr(main, "usage_store", UsageStore())
     main._idem_cache.clear()
+    main._token_cache.clear()
     main.app.state.limiter = FakeLimiter()
     client = FakeHTTPClient()
     client.queue_post({"task_id": "task-123"})
     client.queue_get({"status": "completed", "duration": 60})
     main.app.state.http_client = client
-    def fake_verify(header):
+    async def fake_verify(header):
         if header is None:
             raise main.HTTPException(status_code=401, detail="missing_token")
         return {"uid": "user-1", "firebase": {"tenant": "tenant-1"}}
@@ -66,13 +73,14 @@ def test_missing_token_returns_401():
     with pytest.raises(main.HTTPException) as exc:
         asyncio.run(
             main.transcribe(
-                Request(),
-                file=upload,
-                language="th",
-                format="text",
-                model_size=main.settings.default_model,
-                word_timestamps=False,
-                diarization=False,
+                form=main.TranscribeForm(
+                    file=upload,
+                    language="th",
+                    format="text",
+                    model_size=MODEL,
+                    word_timestamps=False,
+                    diarization=False,
+                ),
                 authorization=None,
                 limiter=main.app.state.limiter,
                 client=main.app.state.http_client,
@@ -85,16 +93,31 @@ def test_valid_token_allows_request():
     upload = UploadFile("sample.wav", b"1234", "audio/wav")
     response = asyncio.run(
         main.transcribe(
-            Request(),
-            file=upload,
-            language="th",
-            format="text",
-            model_size=main.settings.default_model,
-            word_timestamps=False,
-            diarization=False,
+            form=main.TranscribeForm(
+                file=upload,
+                language="th",
+                format="text",
+                model_size=MODEL,
+                word_timestamps=False,
+                diarization=False,
+            ),
             authorization="Bearer test",
             limiter=main.app.state.limiter,
             client=main.app.state.http_client,
         )
     )
     assert response.json()["task_id"] == "task-123"
+
+
+def test_verified_token_is_cached(monkeypatch):
+    calls = []
+
+    def verify(token, request):
+        calls.append(token)
+        return {"uid": "user-1", "aud": main.settings.firebase_project_id, "exp": time.time() + 3600}
+
+    monkeypatch.setattr(main.id_token, "verify_oauth2_token", verify)
+    first = asyncio.run(_verify_firebase_token("Bearer abc"))
+    second = asyncio.run(_verify_firebase_token("Bearer abc"))
+    assert first is second
+    assert calls == ["abc"]
@@ -1,5 +1,6 @@
 import asyncio
 import os
+from dataclasses import replace
 
 os.environ.setdefault("WHISPER_API_KEY", "sk-live-example-1234567890")
 os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
@@ -8,14 +9,19 @@ import pytest
 
 from backend import main
 from backend.fastapi_stub import Request, UploadFile
-from backend.usage_store import usage_store
+from backend.usage_store import UsageStore
 from backend.tests.utils import build_response
 
+MODEL = main.settings.default_model
+
 
 class FakeLimiter:
     async def hit(self, scope: str, rate: int) -> bool:
         return True
 
+    async def hit_many(self, scopes):
+        return [True for _ in scopes]
+
 
 class FakeHTTPClient:
     def __init__(self) -> None:
@@ -40,16 +46,14 @@ class FakeHTTPClient:
 
 @pytest.fixture(autouse=True)
 def setup(monkeypatch):
-    usage_store._user_records.clear()
-    usage_store._tenant_records.clear()
-    usage_store._jobs.clear()
+    monkeypatch.setattr(main, "usage_store", UsageStore())
     main._idem_cache.clear()
     main.app.state.limiter = FakeLimiter()
     client = FakeHTTPClient()
     client.queue_post({"task_id": "task-xyz"})
     client.queue_get({"status": "completed", "duration": 120, "text": "สวัสดี"})
     main.app.state.http_client = client
-    def fake_verify(header):
+    async def fake_verify(header):
         if header is None:
             raise main.HTTPException(status_code=401, detail="missing_token")
         return {"uid": "user-1", "firebase": {"tenant": "tenant-1"}}
@@ -61,13 +65,14 @@ def setup(monkeypatch):
 def test_transcribe_status_and_usage_flow():
     response = asyncio.run(
         main.transcribe(
-            Request(),
-            file=UploadFile("sample.wav", b"0" * 1024 * 1024, "audio/wav"),
-            language="th",
-            format="text",
-            model_size=main.settings.default_model,
-            word_timestamps=False,
-            diarization=False,
+            form=main.TranscribeForm(
+                file=UploadFile("sample.wav", b"0" * 1024 * 1024, "audio/wav"),
+                language="th",
+                format="text",
+                model_size=MODEL,
+                word_timestamps=False,
+                diarization=False,
+            ),
             authorization="Bearer t",
             limiter=main.app.state.limiter,
             client=main.app.state.http_client,
@@ -89,3 +94,36 @@ def test_transcribe_status_and_usage_flow():
     body = usage_resp.json()
     assert body["minutes_today"] >= 2
     assert body["limits"]["default_model"] == main.settings.default_model
+
+
+def test_transcribe_form_from_request():
+    upload = UploadFile("sample.wav", b"0", "audio/wav")
+    default = asyncio.run(main.TranscribeForm.from_request(Request(form={"file": upload})))
+    assert default == main.TranscribeForm(upload)
+
+    custom = asyncio.run(
+        main.TranscribeForm.from_request(
+            Request(form={"file": upload, "language": "en", "word_timestamps": "true"})
+        )
+    )
+    assert custom.language == "en"
+    assert custom.word_timestamps is True
+    assert custom.diarization is False
+
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.TranscribeForm.from_request(Request(form={"language": "th"})))
+    assert exc.value.status_code == 422
+
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(
+            main.TranscribeForm.from_request(Request(form={"file": upload, "diarization": "maybe"}))
+        )
+    assert exc.value.status_code == 422
+    assert exc.value.detail == "invalid_diarization"
+
+
+def test_transcribe_form_default_model_follows_settings(monkeypatch):
+    monkeypatch.setattr(main, "settings", replace(main.settings, default_model="small"))
+    upload = UploadFile("sample.wav", b"0", "audio/wav")
+    form = asyncio.run(main.TranscribeForm.from_request(Request(form={"file": upload})))
+    assert form.model_size == "small"
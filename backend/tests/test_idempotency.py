@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("WHISPER_API_KEY", "sk-live-example-1234567890")
+os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
+
+import pytest
+
+from backend import main
+from backend.fastapi_stub import UploadFile
+from backend.usage_store import UsageStore
+from backend.tests.utils import build_response
+
+MODEL = main.settings.default_model
+
+
+class FakeLimiter:
+    async def hit(self, scope: str, rate: int) -> bool:
+        return True
+
+    async def hit_many(self, scopes):
+        return [True for _ in scopes]
+
+
+class GatedHTTPClient:
+    """Upstream whose first POST blocks until ``gate`` is set."""
+
+    def __init__(self) -> None:
+        self.gate = asyncio.Event()
+        self.post_responses = []
+        self.posts = 0
+
+    def queue_post(self, payload, status_code=200):
+        self.post_responses.append((payload, status_code))
+
+    async def post(self, *args, **kwargs):
+        self.posts += 1
+        if self.posts == 1:
+            await self.gate.wait()
+        payload, status_code = self.post_responses.pop(0)
+        return build_response(payload, status_code)
+
+    async def aclose(self):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = UsageStore()
+    store.reserve_calls = 0
+    reserve = store.reserve
+
+    def counting_reserve(*args, **kwargs):
+        store.reserve_calls += 1
+        return reserve(*args, **kwargs)
+
+    store.reserve = counting_reserve
+    monkeypatch.setattr(main, "usage_store", store)
+    main._idem_cache.clear()
+    main._idem_inflight.clear()
+
+    async def fake_verify(header):
+        return {"uid": "user-1", "firebase": {"tenant": "tenant-1"}}
+
+    monkeypatch.setattr(main, "verify_firebase_token", fake_verify)
+    return store
+
+
+def _transcribe(client, key="idem-1"):
+    return main.transcribe(
+        form=main.TranscribeForm(
+            file=UploadFile("a.wav", b"1" * 1024, "audio/wav"),
+            language="th",
+            format="text",
+            model_size=MODEL,
+            word_timestamps=False,
+            diarization=False,
+        ),
+        authorization="Bearer t",
+        idempotency_key=key,
+        limiter=FakeLimiter(),
+        client=client,
+    )
+
+
+async def _race(client):
+    first = asyncio.create_task(_transcribe(client))
+    second = asyncio.create_task(_transcribe(client))
+    for _ in range(10):
+        await asyncio.sleep(0)
+    # The owner is parked on the upstream call; the duplicate is waiting on it.
+    assert ("user-1", "idem-1") in main._idem_inflight
+    assert client.posts == 1
+    client.gate.set()
+    return await asyncio.gather(first, second, return_exceptions=True)
+
+
+def test_concurrent_duplicates_submit_once(store):
+    client = GatedHTTPClient()
+    client.queue_post({"task_id": "task-1"})
+
+    first, second = asyncio.run(_race(client))
+
+    assert first.json() == second.json() == {"task_id": "task-1"}
+    assert client.posts == 1
+    assert store.reserve_calls == 1
+    assert main._idem_inflight == {}
+
+
+def test_waiter_retries_when_owner_fails(store):
+    client = GatedHTTPClient()
+    client.queue_post({"error": "boom"}, status_code=500)
+    client.queue_post({"task_id": "task-2"})
+
+    first, second = asyncio.run(_race(client))
+
+    assert isinstance(first, main.HTTPException)
+    assert first.status_code == 500
+    assert second.json() == {"task_id": "task-2"}
+    assert client.posts == 2
+    assert store.reserve_calls == 2
+    assert main._idem_cache[("user-1", "idem-1")][1] == {"task_id": "task-2"}
+
+
+def test_replay_from_cache_skips_reserve(store):
+    client = GatedHTTPClient()
+    main._idem_put(("user-1", "idem-1"), {"task_id": "task-cached"})
+
+    response = asyncio.run(_transcribe(client))
+
+    assert response.json() == {"task_id": "task-cached"}
+    assert client.posts == 0
+    assert store.reserve_calls == 0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = SimpleNamespace(now=1_000.0)
+    monkeypatch.setattr(main, "time", SimpleNamespace(monotonic=lambda: fake.now, time=time.time))
+    return fake
+
+
+def test_idem_entry_expires_after_ttl(clock):
+    main._idem_put(("user-1", "k"), {"task_id": "t"})
+    clock.now += main._IDEM_TTL_SECONDS - 1
+    assert main._idem_get(("user-1", "k")) == {"task_id": "t"}
+    clock.now += 1
+    assert main._idem_get(("user-1", "k")) is None
+    assert ("user-1", "k") not in main._idem_cache
+
+
+def test_idem_cache_evicts_least_recently_used(clock, monkeypatch):
+    monkeypatch.setattr(main, "_IDEM_MAX_ENTRIES", 2)
+    main._idem_put(("user-1", "a"), {"task_id": "a"})
+    main._idem_put(("user-1", "b"), {"task_id": "b"})
+    assert main._idem_get(("user-1", "a")) is not None  # "a" becomes most recent
+    main._idem_put(("user-1", "c"), {"task_id": "c"})
+    assert list(main._idem_cache) == [("user-1", "a"), ("user-1", "c")]
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from backend import limiter as limiter_module
+from backend.limiter import REDIS_SCRIPT, InMemoryTokenBucket, NoScriptError, RedisTokenBucket
+
+SECOND = 1_000_000_000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = SimpleNamespace(now=1_000 * SECOND)
+    monkeypatch.setattr(limiter_module, "time", SimpleNamespace(monotonic_ns=lambda: fake.now))
+    return fake
+
+
+def test_burst_up_to_rate_then_denied(clock):
+    bucket = InMemoryTokenBucket()
+    results = [asyncio.run(bucket.allow("k", rate=3)) for _ in range(4)]
+    assert results == [True, True, True, False]
+
+
+def test_bucket_refills_after_emission_interval(clock):
+    bucket = InMemoryTokenBucket()
+    for _ in range(3):
+        assert asyncio.run(bucket.allow("k", rate=3))
+    assert not asyncio.run(bucket.allow("k", rate=3))
+    clock.now += 20 * SECOND  # window / rate
+    assert asyncio.run(bucket.allow("k", rate=3))
+    assert not asyncio.run(bucket.allow("k", rate=3))
+
+
+def test_denied_hit_does_not_move_tat(clock):
+    bucket = InMemoryTokenBucket()
+    assert asyncio.run(bucket.allow("k", rate=1))
+    tat = bucket._buckets["k"]
+    assert not asyncio.run(bucket.allow("k", rate=1))
+    assert bucket._buckets["k"] == tat
+
+
+def test_zero_rate_is_denied(clock):
+    bucket = InMemoryTokenBucket()
+    assert not asyncio.run(bucket.allow("k", rate=0))
+    assert "k" not in bucket._buckets
+
+
+def test_allow_many_charges_all_or_none(clock):
+    bucket = InMemoryTokenBucket()
+    assert asyncio.run(bucket.allow("user", rate=1))
+    assert asyncio.run(bucket.allow("tenant", rate=5))
+    tenant_tat = bucket._buckets["tenant"]
+
+    assert asyncio.run(bucket.allow_many([("user", 1), ("tenant", 5)])) == [False, True]
+    assert bucket._buckets["tenant"] == tenant_tat
+
+
+class FlushedScriptCacheRedis:
+    """Fake client whose script cache was flushed once (e.g. after a failover)."""
+
+    def __init__(self) -> None:
+        self.loads = 0
+        self.eval_calls = []
+        self.evalsha_calls = []
+
+    async def script_load(self, script):
+        self.loads += 1
+        return f"sha-{self.loads}"
+
+    async def evalsha(self, sha, numkeys, *args):
+        self.evalsha_calls.append(sha)
+        if len(self.evalsha_calls) == 1:
+            raise NoScriptError("NOSCRIPT")
+        return [1] * numkeys
+
+    async def eval(self, script, numkeys, *args):
+        self.eval_calls.append((script, numkeys, args))
+        return [1] * numkeys
+
+
+def test_redis_bucket_falls_back_to_eval_on_noscript():
+    client = FlushedScriptCacheRedis()
+    bucket = RedisTokenBucket(client)
+    assert asyncio.run(bucket.load_script()) == "sha-1"
+
+    assert asyncio.run(bucket.allow_many([("user", 30), ("tenant", 120)])) == [True, True]
+    assert client.eval_calls == [(REDIS_SCRIPT, 2, ("user", "tenant", 60, 1, 30, 120))]
+    assert bucket._sha == "sha-2"
+
+    assert asyncio.run(bucket.allow("user", 30))
+    assert client.evalsha_calls == ["sha-1", "sha-2"]
@@ -1,5 +1,6 @@
 import asyncio
 import os
+from dataclasses import replace
 
 os.environ.setdefault("WHISPER_API_KEY", "sk-live-example-1234567890")
 os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
@@ -7,46 +8,57 @@ os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-whisper-th")
 import pytest
 
 from backend import main
-from backend.fastapi_stub import Request, UploadFile
-from backend.usage_store import usage_store
+from backend.fastapi_stub import UploadFile
+from backend.usage_store import UsageStore
 from backend.tests.utils import build_response
 
+BIG = b"1" * 1024 * 1024
+MODEL = main.settings.default_model
+
 
 class FakeLimiter:
     def __init__(self) -> None:
-        from collections import defaultdict
-
-        self.counts = defaultdict(int)
-        self.thresholds = {}
+        self.counts: dict[str, int] = {}
+        self.thresholds: dict[str, int] = {}
 
     def set_limit(self, scope: str, limit: int) -> None:
         self.thresholds[scope] = limit
 
     async def hit(self, scope: str, rate: int) -> bool:
-        self.counts[scope] += 1
-        limit = self.thresholds.get(scope, rate)
-        return self.counts[scope] <= limit
+        count = self.counts[scope] = self.counts.get(scope, 0) + 1
+        return count <= self.thresholds.get(scope, rate)
+
+    async def hit_many(self, scopes):
+        return [await self.hit(scope, rate) for scope, rate in scopes]
 
 
 class FakeHTTPClient:
     def __init__(self) -> None:
         self.post_responses = []
+        self.posted = []
 
     def queue_post(self, payload):
         self.post_responses.append(payload)
 
     async def post(self, *args, **kwargs):
+        self.posted.append(kwargs)
         return build_response(self.post_responses.pop(0))
 
     async def aclose(self):
         return None
 
 
+@pytest.fixture(scope="module")
+def run():
+    # One loop for the whole module instead of a fresh one per asyncio.run call.
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
 @pytest.fixture(autouse=True)
 def setup(monkeypatch):
-    usage_store._user_records.clear()
-    usage_store._tenant_records.clear()
-    usage_store._jobs.clear()
+    monkeypatch.setattr(main, "usage_store", UsageStore())
     main._idem_cache.clear()
     limiter = FakeLimiter()
     main.app.state.limiter = limiter
@@ -54,7 +66,7 @@ def setup(monkeypatch):
     client.queue_post({"task_id": "task-a"})
     client.queue_post({"task_id": "task-b"})
     main.app.state.http_client = client
-    def fake_verify(header):
+    async def fake_verify(header):
         if header is None:
             raise main.HTTPException(status_code=401, detail="missing_token")
         return {"uid": "user-1", "firebase": {"tenant": "tenant-1"}}
@@ -63,19 +75,20 @@ def setup(monkeypatch):
     yield limiter
 
 
-def test_rate_limit_exceeded(setup):
+def test_rate_limit_exceeded(setup, run):
     limiter = setup
-    limiter.set_limit("user:user-1", 1)
-    upload = UploadFile("a.wav", b"1" * 1024 * 1024, "audio/wav")
-    response = asyncio.run(
+    limiter.set_limit("{tenant-1}:rl:user:user-1", 1)
+    upload = UploadFile("a.wav", BIG, "audio/wav")
+    response = run(
         main.transcribe(
-            Request(),
-            file=upload,
-            language="th",
-            format="text",
-            model_size=main.settings.default_model,
-            word_timestamps=False,
-            diarization=False,
+            form=main.TranscribeForm(
+                file=upload,
+                language="th",
+                format="text",
+                model_size=MODEL,
+                word_timestamps=False,
+                diarization=False,
+            ),
             authorization="Bearer t",
             limiter=main.app.state.limiter,
             client=main.app.state.http_client,
@@ -83,15 +96,16 @@ def test_rate_limit_exceeded(setup):
     )
     assert response.json()["task_id"] == "task-a"
     with pytest.raises(main.HTTPException) as exc:
-        asyncio.run(
+        run(
             main.transcribe(
-                Request(),
-                file=UploadFile("a.wav", b"1" * 1024 * 1024, "audio/wav"),
-                language="th",
-                format="text",
-                model_size=main.settings.default_model,
-                word_timestamps=False,
-                diarization=False,
+                form=main.TranscribeForm(
+                    file=upload,
+                    language="th",
+                    format="text",
+                    model_size=MODEL,
+                    word_timestamps=False,
+                    diarization=False,
+                ),
                 authorization="Bearer t",
                 limiter=main.app.state.limiter,
                 client=main.app.state.http_client,
@@ -101,18 +115,19 @@ def test_rate_limit_exceeded(setup):
     assert exc.value.detail == "rate_limited_user"
 
 
-def test_quota_exceeded(monkeypatch):
-    monkeypatch.setattr(main.settings, "minutes_per_day", 1)
-    monkeypatch.setattr(main.settings, "concurrent_user", 2)
-    first = asyncio.run(
+def test_quota_exceeded(monkeypatch, run):
+    monkeypatch.setattr(main, "settings", replace(main.settings, minutes_per_day=1, concurrent_user=2))
+    upload = UploadFile("a.wav", BIG, "audio/wav")
+    first = run(
         main.transcribe(
-            Request(),
-            file=UploadFile("a.wav", b"1" * 1024 * 1024, "audio/wav"),
-            language="th",
-            format="text",
-            model_size=main.settings.default_model,
-            word_timestamps=False,
-            diarization=False,
+            form=main.TranscribeForm(
+                file=upload,
+                language="th",
+                format="text",
+                model_size=MODEL,
+                word_timestamps=False,
+                diarization=False,
+            ),
             authorization="Bearer t",
             limiter=main.app.state.limiter,
             client=main.app.state.http_client,
@@ -120,15 +135,16 @@ def test_quota_exceeded(monkeypatch):
     )
     assert first.json()["task_id"] == "task-a"
     with pytest.raises(main.HTTPException) as exc:
-        asyncio.run(
+        run(
             main.transcribe(
-                Request(),
-                file=UploadFile("a.wav", b"1" * 1024 * 1024, "audio/wav"),
-                language="th",
-                format="text",
-                model_size=main.settings.default_model,
-                word_timestamps=False,
-                diarization=False,
+                form=main.TranscribeForm(
+                    file=upload,
+                    language="th",
+                    format="text",
+                    model_size=MODEL,
+                    word_timestamps=False,
+                    diarization=False,
+                ),
                 authorization="Bearer t",
                 limiter=main.app.state.limiter,
                 client=main.app.state.http_client,
@@ -138,31 +154,33 @@ def test_quota_exceeded(monkeypatch):
     assert exc.value.detail == "quota_day"
 
 
-def test_concurrency_exceeded():
-    asyncio.run(
+def test_concurrency_exceeded(run):
+    run(
         main.transcribe(
-            Request(),
-            file=UploadFile("a.wav", b"1" * 1024 * 1024, "audio/wav"),
-            language="th",
-            format="text",
-            model_size=main.settings.default_model,
-            word_timestamps=False,
-            diarization=False,
+            form=main.TranscribeForm(
+                file=UploadFile("a.wav", BIG, "audio/wav"),
+                language="th",
+                format="text",
+                model_size=MODEL,
+                word_timestamps=False,
+                diarization=False,
+            ),
             authorization="Bearer t",
             limiter=main.app.state.limiter,
             client=main.app.state.http_client,
         )
     )
     with pytest.raises(main.HTTPException) as exc:
-        asyncio.run(
+        run(
             main.transcribe(
-                Request(),
-                file=UploadFile("b.wav", b"1" * 1024 * 1024, "audio/wav"),
-                language="th",
-                format="text",
-                model_size=main.settings.default_model,
-                word_timestamps=False,
-                diarization=False,
+                form=main.TranscribeForm(
+                    file=UploadFile("b.wav", BIG, "audio/wav"),
+                    language="th",
+                    format="text",
+                    model_size=MODEL,
+                    word_timestamps=False,
+                    diarization=False,
+                ),
                 authorization="Bearer t",
                 limiter=main.app.state.limiter,
                 client=main.app.state.http_client,
@@ -170,3 +188,49 @@ def test_concurrency_exceeded():
         )
     assert exc.value.status_code == 409
     assert exc.value.detail == "concurrency_user"
+
+
+def test_replaced_settings_apply_without_reimport(monkeypatch, run):
+    monkeypatch.setattr(main, "settings", replace(main.settings, max_file_mb=0, minutes_per_day=7))
+    with pytest.raises(main.HTTPException) as exc:
+        run(
+            main.transcribe(
+                form=main.TranscribeForm(file=UploadFile("a.wav", BIG, "audio/wav")),
+                authorization="Bearer t",
+                limiter=main.app.state.limiter,
+                client=main.app.state.http_client,
+            )
+        )
+    assert exc.value.status_code == 413
+    usage = run(main.me_usage(authorization="Bearer t")).json()
+    assert usage["limits"]["minutes_per_day"] == 7
+
+
+def test_upload_forwarded_without_spooling_to_disk(run):
+    upload = UploadFile("a.wav", BIG, "audio/wav")
+    run(
+        main.transcribe(
+            form=main.TranscribeForm(file=upload),
+            authorization="Bearer t",
+            limiter=main.app.state.limiter,
+            client=main.app.state.http_client,
+        )
+    )
+    stream = main.app.state.http_client.posted[0]["files"]["file"][1]
+    assert not hasattr(stream, "fileno")
+    assert stream.seek(0, 2) == len(BIG)
+    assert stream.seek(0) == 0 and stream.read(4) == b"1111"
+    assert upload.file._rolled is False
+
+
+def test_upload_size_without_size_reads_in_chunks(run):
+    upload = UploadFile("a.wav", BIG, "audio/wav")
+    upload.size = None
+    assert run(main._upload_size(upload, 4 * len(BIG))) == len(BIG)
+    assert upload.file.tell() == 0
+
+    big = UploadFile("a.wav", BIG * 4, "audio/wav")
+    big.size = None
+    # Reading stops at the first chunk past the cap rather than draining the upload.
+    assert run(main._upload_size(big, len(BIG) // 2)) == len(BIG)
+    assert big.file.tell() == 0
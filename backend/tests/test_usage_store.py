@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import usage_store as usage_store_module
+from backend.usage_store import UsageStore
+
+LIMITS = {
+    "concurrent_user": 1,
+    "concurrent_tenant": 5,
+    "minutes_per_day": 60,
+    "minutes_per_month": 1200,
+}
+
+
+def test_reserve_confirm_commit_releases_reservation():
+    store = UsageStore()
+    assert store.reserve("tenant-1", "user-1", 5, "res-1", LIMITS) == (True, "")
+    store.confirm("res-1", "task-1")
+    store.commit("task-1", 2)
+    store.commit("task-1", 2)  # repeated status polls must not double count
+
+    snap = store.snapshot("tenant-1", "user-1")
+    assert snap["minutes_today"] == 2
+    assert snap["minutes_month"] == 2
+    assert snap["reserved_minutes"] == 0
+    assert snap["running_jobs_user"] == 0
+    assert snap["running_jobs_tenant"] == 0
+
+
+def test_rollback_frees_concurrency_slot():
+    store = UsageStore()
+    assert store.reserve("tenant-1", "user-1", 5, "res-1", LIMITS) == (True, "")
+    assert store.reserve("tenant-1", "user-1", 5, "res-2", LIMITS) == (False, "concurrency_user")
+    store.rollback("res-1")
+    assert store.reserve("tenant-1", "user-1", 5, "res-2", LIMITS) == (True, "")
+    assert store.snapshot("tenant-1", "user-1")["reserved_minutes"] == 5
+
+
+def test_reserve_rejects_over_quota():
+    store = UsageStore()
+    limits = dict(LIMITS, concurrent_user=5, minutes_per_day=6)
+    assert store.reserve("tenant-1", "user-1", 5, "res-1", limits) == (True, "")
+    assert store.reserve("tenant-1", "user-1", 2, "res-2", limits) == (False, "quota_day")
+    limits["minutes_per_day"] = 60
+    limits["minutes_per_month"] = 6
+    assert store.reserve("tenant-1", "user-1", 2, "res-2", limits) == (False, "quota_month")
+
+
+def test_minutes_roll_over_on_new_day():
+    store = UsageStore()
+    store.commit_minutes("tenant-1", "user-1", 3)
+    shard = usage_store_module._shard("user-1")
+    uc = store._user_counters[shard]["tenant-1"]["user-1"]
+    uc.day_key = "19700101"  # pretend the usage was recorded on an earlier day
+
+    snap = store.snapshot("tenant-1", "user-1")
+    assert snap["minutes_today"] == 0
+    assert snap["minutes_month"] == 3
+
+
+def test_period_keys_refresh_at_utc_midnight(monkeypatch):
+    midnight = 1_767_225_600  # 2026-01-01T00:00:00Z
+    monkeypatch.setattr(usage_store_module, "_keys_cache", (0.0, "", ""))
+    monkeypatch.setattr(usage_store_module.time, "time", lambda: midnight - 1)
+    assert usage_store_module._now_keys() == ("20251231", "202512")
+    monkeypatch.setattr(usage_store_module.time, "time", lambda: midnight)
+    assert usage_store_module._now_keys() == ("20260101", "202601")
+
+
+def test_to_minutes_rounds_up_to_whole_minutes():
+    assert usage_store_module._to_minutes(3) == 3
+    assert usage_store_module._to_minutes(0) == 1
+    assert usage_store_module._to_minutes(2.1) == 3
+    assert usage_store_module._to_minutes(0.2) == 1
+
+
+def test_snapshot_of_unknown_user_does_not_create_counters():
+    store = UsageStore()
+    assert store.snapshot("tenant-1", "nobody")["minutes_today"] == 0
+    assert store.running_user("tenant-1", "nobody") == 0
+    assert not any(store._user_counters)
+
+
+def test_concurrent_reserve_and_commit_keep_counters_consistent():
+    store = UsageStore()
+    limits = dict(LIMITS, concurrent_user=100, concurrent_tenant=100, minutes_per_day=10_000)
+
+    def run(i):
+        user = f"user-{i % 8}"
+        ok, _ = store.reserve("tenant-1", user, 2, f"res-{i}", limits)
+        assert ok
+        store.commit(f"res-{i}", 1)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(run, range(400)))
+
+    assert store.running_tenant("tenant-1") == 0
+    for n in range(8):
+        snap = store.snapshot("tenant-1", f"user-{n}")
+        assert snap["minutes_today"] == 50
+        assert snap["reserved_minutes"] == 0
+        assert snap["running_jobs_user"] == 0
+
+
+def test_confirm_with_same_id_keeps_job():
+    store = UsageStore()
+    assert store.reserve("tenant-1", "user-1", 5, "task-1", LIMITS) == (True, "")
+    store.confirm("task-1", "task-1")
+    assert store._jobs["task-1"].task_id == "task-1"
+    store.commit("task-1", 2)
+    assert store.snapshot("tenant-1", "user-1")["minutes_today"] == 2
+
+
+def test_snapshot_is_cached_until_counters_change():
+    store = UsageStore()
+    limits = dict(LIMITS, concurrent_user=5)
+    store.reserve("tenant-1", "user-1", 5, "res-1", limits)
+    first = store.snapshot("tenant-1", "user-1")
+    assert store.snapshot("tenant-1", "user-1") is first
+
+    store.reserve("tenant-1", "user-2", 5, "res-2", limits)  # other user, same tenant
+    assert store.snapshot("tenant-1", "user-1")["running_jobs_tenant"] == 2
+
+    store.commit("res-1", 3)
+    snap = store.snapshot("tenant-1", "user-1")
+    assert (snap["minutes_today"], snap["reserved_minutes"], snap["running_jobs_user"]) == (3, 0, 0)
@@ -5,23 +5,26 @@ from typing import Any
 
 from backend import main
 
+_httpx_status_error = getattr(getattr(main, "httpx", None), "HTTPStatusError", None)
+
 
 class _FakeResponse:
+    __slots__ = ("_payload", "status_code", "_method")
+
     def __init__(self, payload: dict[str, Any], status_code: int, method: str) -> None:
         self._payload = payload
         self.status_code = status_code
         self._method = method
-        self._request = getattr(main, "httpx", None)
 
     def json(self) -> dict[str, Any]:
         return self._payload
 
     def raise_for_status(self) -> None:
-        if self.status_code >= 400:
-            httpx_module = getattr(main, "httpx", None)
-            if httpx_module and hasattr(httpx_module, "HTTPStatusError"):
-                raise httpx_module.HTTPStatusError("error", request=None, response=self)  # type: ignore[arg-type]
-            raise RuntimeError("HTTP error")
+        if self.status_code < 400:
+            return
+        if _httpx_status_error is not None:
+            raise _httpx_status_error("error", request=None, response=self)  # type: ignore[arg-type]
+        raise RuntimeError("HTTP error")
 
 
 def build_response(payload: dict[str, Any], status_code: int = 200, method: str = "POST") -> _FakeResponse:
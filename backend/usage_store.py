@@ -10,68 +10,182 @@ Usage store (in-memory, thread-safe) สำหรับนับโควตา/
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from threading import RLock
-from typing import Dict, Tuple
-import math
+from threading import Lock
+from typing import Dict, Final, List, Optional, Tuple
+import time
 
+# จำนวน shard (ต้องเป็นกำลังสอง) – แยก lock ต่อ shard เพื่อลดการแย่ง lock เดียว
+_SHARDS: Final = 16
+_SHARD_MASK: Final = _SHARDS - 1
 
-def _day_key() -> str:
+# (เวลาเที่ยงคืน UTC ถัดไปแบบ epoch, day key, month key) – คำนวณใหม่เฉพาะเมื่อข้ามวัน
+_keys_cache: Tuple[float, str, str] = (0.0, "", "")
+
+
+def _now_keys() -> Tuple[str, str]:
+    """
+    คืน (day_key, month_key) ของเวลาปัจจุบัน
+    กรณีปกติเป็นแค่ time.time() + เทียบตัวเลขหนึ่งครั้ง; format ใหม่เฉพาะตอนข้ามวัน (UTC)
+    """
+    global _keys_cache
+    now = time.time()
+    cache = _keys_cache
+    if now < cache[0] and now >= cache[0] - 86400:
+        return cache[1], cache[2]
     # ใช้ UTC ให้สอดคล้องกันทุกอินสแตนซ์
-    return datetime.now(timezone.utc).strftime("%Y%m%d")
+    dt = datetime.fromtimestamp(now, timezone.utc)
+    next_midnight = (now // 86400 + 1) * 86400
+    _keys_cache = (next_midnight, dt.strftime("%Y%m%d"), dt.strftime("%Y%m"))
+    return _keys_cache[1], _keys_cache[2]
 
 
-def _month_key() -> str:
-    return datetime.now(timezone.utc).strftime("%Y%m")
+def _to_minutes(minutes: float) -> int:
+    """
+    ปัดขึ้นเป็นนาทีเต็ม (อย่างน้อย 1) – กรณีปกติผู้เรียกส่ง int มาอยู่แล้วจึงคืนได้ทันที
+    """
+    if type(minutes) is int:
+        return minutes if minutes >= 1 else 1
+    whole = int(-(-minutes // 1))
+    return whole if whole >= 1 else 1
 
 
-@dataclass
+def _shard(key: str) -> int:
+    return hash(key) & _SHARD_MASK
+
+
+@dataclass(slots=True)
 class UserCounters:
+    # นาทีที่ใช้จริงของวัน/เดือนตาม day_key/month_key (รีเซ็ตเมื่อ key เปลี่ยน)
+    day_key: str = ""
+    month_key: str = ""
     minutes_today: int = 0
     minutes_month: int = 0
     reserved_minutes: int = 0
     running_jobs: int = 0
+    # snapshot ล่าสุด (None = ค่ามีการเปลี่ยน ต้องสร้างใหม่)
+    _snap: Optional[Dict[str, int]] = None
+
+
+# ค่าว่างที่ใช้ร่วมกันสำหรับการอ่านอย่างเดียว – ห้ามแก้ไข
+_EMPTY_COUNTERS = UserCounters()
+
+
+@dataclass(slots=True)
+class UsageJob:
+    tenant_id: str
+    user_id: str
+    minutes: int
+    task_id: Optional[str] = None
 
 
 class UsageStore:
     """
-    โครงสร้างข้อมูล:
-      - per (tenant_id, user_id, day)   -> minutes_today
-      - per (tenant_id, user_id, month) -> minutes_month
-      - per (tenant_id, user_id)        -> UserCounters (รวม reserved & running_jobs)
-      - per tenant_id                   -> running_jobs_tenant
+    โครงสร้างข้อมูล (แบ่งเป็น _SHARDS ส่วน แต่ละส่วนมี lock ของตัวเอง):
+      - per tenant_id -> user_id        -> UserCounters (นาทีวัน/เดือน, reserved & running_jobs)
+                                           shard ตาม hash(user_id)
+      - per tenant_id                   -> running_jobs_tenant, shard ตาม hash(tenant_id)
+      - per reservation_id / task_id    -> UsageJob (งานที่กันโควตาไว้) ใช้ lock แยก
+    ลำดับการถือ lock: user shard -> tenant shard -> jobs (ห้ามสลับ)
     """
 
     def __init__(self) -> None:
-        self._lock = RLock()
-        self._per_user_day: Dict[Tuple[str, str, str], int] = {}
-        self._per_user_month: Dict[Tuple[str, str, str], int] = {}
-        self._user_counters: Dict[Tuple[str, str], UserCounters] = {}
-        self._running_jobs_tenant: Dict[str, int] = {}
+        self._user_locks = [Lock() for _ in range(_SHARDS)]
+        self._user_counters: List[Dict[str, Dict[str, UserCounters]]] = [{} for _ in range(_SHARDS)]
+        self._tenant_locks = [Lock() for _ in range(_SHARDS)]
+        self._running_jobs_tenant: List[Dict[str, int]] = [{} for _ in range(_SHARDS)]
+        self._jobs_lock = Lock()
+        self._jobs: Dict[str, UsageJob] = {}
+
+    # ---------- helpers (ต้องถือ lock ของ shard นั้นอยู่แล้ว) ----------
+    def _uc(self, shard: int, tenant_id: str, user_id: str) -> UserCounters:
+        # dict ซ้อน tenant -> user แทน key แบบ tuple (ไม่ต้องสร้าง tuple ทุกครั้ง)
+        tenants = self._user_counters[shard]
+        users = tenants.get(tenant_id)
+        if users is None:
+            users = tenants[tenant_id] = {}
+        uc = users.get(user_id)
+        if uc is None:
+            uc = users[user_id] = UserCounters()
+        return uc
+
+    def _uc_readonly(self, shard: int, tenant_id: str, user_id: str) -> UserCounters:
+        # อ่านอย่างเดียว: ไม่สร้าง entry ใหม่ให้ user ที่ยังไม่เคยใช้งาน
+        users = self._user_counters[shard].get(tenant_id)
+        uc = users.get(user_id) if users is not None else None
+        if uc is None:
+            return _EMPTY_COUNTERS
+        self._rollover(uc)
+        return uc
+
+    @staticmethod
+    def _rollover(uc: UserCounters) -> None:
+        # ข้ามวัน/เดือนแล้ว -> เริ่มนับใหม่
+        day_key, month_key = _now_keys()
+        if uc.day_key != day_key:
+            uc.day_key = day_key
+            uc.minutes_today = 0
+            uc._snap = None
+        if uc.month_key != month_key:
+            uc.month_key = month_key
+            uc.minutes_month = 0
+            uc._snap = None
+
+    def _quota_reason(self, uc: UserCounters, est: int, day_limit: int, month_limit: int) -> Optional[str]:
+        # est ต้องผ่าน _to_minutes มาแล้ว
+        self._rollover(uc)
+        if uc.minutes_today + uc.reserved_minutes + est > day_limit:
+            return "quota_day"
+        if uc.minutes_month + uc.reserved_minutes + est > month_limit:
+            return "quota_month"
+        return None
 
-    # ---------- helpers ----------
-    def _uc(self, tenant_id: str, user_id: str) -> UserCounters:
-        key = (tenant_id, user_id)
-        if key not in self._user_counters:
-            self._user_counters[key] = UserCounters()
-        return self._user_counters[key]
+    def _add_usage(self, uc: UserCounters, amt: int) -> None:
+        self._rollover(uc)
+        uc._snap = None
+        uc.minutes_today += amt
+        uc.minutes_month += amt
 
-    def _get_today(self, tenant_id: str, user_id: str) -> int:
-        return self._per_user_day.get((tenant_id, user_id, _day_key()), 0)
+    def _add_running_tenant(self, tenant_id: str, delta: int) -> None:
+        shard = _shard(tenant_id)
+        with self._tenant_locks[shard]:
+            running = self._running_jobs_tenant[shard]
+            running[tenant_id] = max(0, running.get(tenant_id, 0) + delta)
 
-    def _get_month(self, tenant_id: str, user_id: str) -> int:
-        return self._per_user_month.get((tenant_id, user_id, _month_key()), 0)
+    def _release(self, job: UsageJob, used_minutes: int = 0) -> None:
+        # คืนนาทีที่กันไว้ + ปล่อยช่อง running job ของ job แล้วบันทึกนาทีที่ใช้จริง (ถ้ามี)
+        shard = _shard(job.user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, job.tenant_id, job.user_id)
+            uc._snap = None
+            uc.reserved_minutes = max(0, uc.reserved_minutes - job.minutes)
+            uc.running_jobs = max(0, uc.running_jobs - 1)
+            if used_minutes:
+                self._add_usage(uc, used_minutes)
+            self._add_running_tenant(job.tenant_id, -1)
 
     # ---------- public API ----------
     def snapshot(self, tenant_id: str, user_id: str) -> Dict[str, int]:
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
-            return {
-                "minutes_today": self._get_today(tenant_id, user_id),
-                "minutes_month": self._get_month(tenant_id, user_id),
+        """
+        คืน dict ที่อาจถูก cache ไว้บน UserCounters – ผู้เรียกห้ามแก้ไข
+        """
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc_readonly(shard, tenant_id, user_id)
+            running_tenant = self.running_tenant(tenant_id)
+            snap = uc._snap
+            # running_jobs_tenant เปลี่ยนได้จาก user อื่น จึงต้องเทียบค่าทุกครั้ง
+            if snap is not None and snap["running_jobs_tenant"] == running_tenant:
+                return snap
+            snap = {
+                "minutes_today": uc.minutes_today,
+                "minutes_month": uc.minutes_month,
                 "reserved_minutes": uc.reserved_minutes,
                 "running_jobs_user": uc.running_jobs,
-                "running_jobs_tenant": self._running_jobs_tenant.get(tenant_id, 0),
+                "running_jobs_tenant": running_tenant,
             }
+            if uc is not _EMPTY_COUNTERS:
+                uc._snap = snap
+            return snap
 
     def can_consume_minutes(
         self,
@@ -83,34 +197,34 @@ class UsageStore:
         """
         ตรวจว่านับรวม reserved แล้ว จะเกิน minutes_per_day / minutes_per_month หรือไม่
         """
-        est = max(1, int(math.ceil(estimate_minutes)))
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
-            minutes_today = self._get_today(tenant_id, user_id)
-            minutes_month = self._get_month(tenant_id, user_id)
-
-            if minutes_today + uc.reserved_minutes + est > limits["minutes_per_day"]:
-                return False
-            if minutes_month + uc.reserved_minutes + est > limits["minutes_per_month"]:
-                return False
-            return True
+        est = _to_minutes(estimate_minutes)
+        day_limit = limits["minutes_per_day"]
+        month_limit = limits["minutes_per_month"]
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            return self._quota_reason(uc, est, day_limit, month_limit) is None
 
     def reserve_minutes(self, tenant_id: str, user_id: str, estimate_minutes: int) -> None:
         """
         กันนาทีไว้ชั่วคราวก่อนส่งงานจริง
         """
-        est = max(1, int(math.ceil(estimate_minutes)))
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
+        est = _to_minutes(estimate_minutes)
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            uc._snap = None
             uc.reserved_minutes += est
 
     def rollback_minutes(self, tenant_id: str, user_id: str, estimate_minutes: int) -> None:
         """
         ยกเลิกการกันนาที (เมื่อ job submit ล้มเหลว)
         """
-        est = max(1, int(math.ceil(estimate_minutes)))
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
+        est = _to_minutes(estimate_minutes)
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            uc._snap = None
             uc.reserved_minutes = max(0, uc.reserved_minutes - est)
 
     def commit_minutes(self, tenant_id: str, user_id: str, actual_minutes: int) -> None:
@@ -119,37 +233,120 @@ class UsageStore:
         - ตัด reserved ออก (เท่าที่กันไว้)
         - เติมลง counters วัน/เดือน
         """
-        amt = max(1, int(math.ceil(actual_minutes)))
-        dayk = (tenant_id, user_id, _day_key())
-        monthk = (tenant_id, user_id, _month_key())
-        with self._lock:
-            self._per_user_day[dayk] = self._per_user_day.get(dayk, 0) + amt
-            self._per_user_month[monthk] = self._per_user_month.get(monthk, 0) + amt
-
-            uc = self._uc(tenant_id, user_id)
+        amt = _to_minutes(actual_minutes)
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            self._add_usage(uc, amt)
             # ตัด reserved ตามจริง แต่อย่าติดลบ
             uc.reserved_minutes = max(0, uc.reserved_minutes - amt)
 
     # ---------- running jobs ----------
     def inc_running(self, tenant_id: str, user_id: str) -> None:
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            uc._snap = None
             uc.running_jobs += 1
-            self._running_jobs_tenant[tenant_id] = self._running_jobs_tenant.get(tenant_id, 0) + 1
+            self._add_running_tenant(tenant_id, 1)
 
     def dec_running(self, tenant_id: str, user_id: str) -> None:
-        with self._lock:
-            uc = self._uc(tenant_id, user_id)
+        shard = _shard(user_id)
+        with self._user_locks[shard]:
+            uc = self._uc(shard, tenant_id, user_id)
+            uc._snap = None
             uc.running_jobs = max(0, uc.running_jobs - 1)
-            self._running_jobs_tenant[tenant_id] = max(0, self._running_jobs_tenant.get(tenant_id, 0) - 1)
+            self._add_running_tenant(tenant_id, -1)
 
+    # อ่านค่าเดียวไม่ต้องถือ lock: dict.get / อ่าน attribute เป็น atomic ภายใต้ GIL
+    # (ห้ามเรียก _rollover ที่นี่เพราะเป็นการเขียน)
     def running_user(self, tenant_id: str, user_id: str) -> int:
-        with self._lock:
-            return self._uc(tenant_id, user_id).running_jobs
+        users = self._user_counters[_shard(user_id)].get(tenant_id)
+        uc = users.get(user_id) if users is not None else None
+        return uc.running_jobs if uc is not None else 0
 
     def running_tenant(self, tenant_id: str) -> int:
-        with self._lock:
-            return self._running_jobs_tenant.get(tenant_id, 0)
+        return self._running_jobs_tenant[_shard(tenant_id)].get(tenant_id, 0)
+
+    # ---------- jobs ----------
+    def reserve(
+        self,
+        tenant_id: str,
+        user_id: str,
+        estimate_minutes: int,
+        reservation_id: str,
+        limits: Dict[str, int],
+    ) -> Tuple[bool, str]:
+        """
+        ตรวจ concurrency + โควตา แล้วกันนาที/นับ running job ในขั้นตอนเดียว (atomic)
+        คืนค่า (ok, reason) โดย reason เป็น concurrency_user / concurrency_tenant / quota_day / quota_month
+        """
+        est = _to_minutes(estimate_minutes)
+        # อ่าน limits ให้เสร็จก่อนเข้า lock
+        user_limit = limits["concurrent_user"]
+        tenant_limit = limits["concurrent_tenant"]
+        day_limit = limits["minutes_per_day"]
+        month_limit = limits["minutes_per_month"]
+        user_shard = _shard(user_id)
+        tenant_shard = _shard(tenant_id)
+        # ถือ lock ของ user shard แล้วตามด้วย tenant shard ตลอดขั้นตอน
+        with self._user_locks[user_shard]:
+            uc = self._uc(user_shard, tenant_id, user_id)
+            if uc.running_jobs >= user_limit:
+                return False, "concurrency_user"
+            with self._tenant_locks[tenant_shard]:
+                running = self._running_jobs_tenant[tenant_shard]
+                running_tenant = running.get(tenant_id, 0)
+                if running_tenant >= tenant_limit:
+                    return False, "concurrency_tenant"
+                reason = self._quota_reason(uc, est, day_limit, month_limit)
+                if reason is not None:
+                    return False, reason
+                running[tenant_id] = running_tenant + 1
+
+            uc._snap = None
+            uc.reserved_minutes += est
+            uc.running_jobs += 1
+            with self._jobs_lock:
+                self._jobs[reservation_id] = UsageJob(tenant_id, user_id, est)
+            return True, ""
+
+    def confirm(self, reservation_id: str, task_id: str) -> None:
+        """
+        ผูก reservation เข้ากับ task_id ที่ได้จาก Whisper
+        """
+        with self._jobs_lock:
+            if reservation_id == task_id:
+                # id เดิม: ไม่ต้อง pop/ใส่ใหม่
+                job = self._jobs.get(task_id)
+                if job is not None:
+                    job.task_id = task_id
+                return
+            job = self._jobs.pop(reservation_id, None)
+            if job is None:
+                return
+            job.task_id = task_id
+            self._jobs[task_id] = job
+
+    def commit(self, job_id: str, actual_minutes: int) -> None:
+        """
+        งานเสร็จ: คืนนาทีที่กันไว้ทั้งหมด แล้วบันทึกนาทีที่ใช้จริง
+        (เรียกซ้ำได้ – งานที่ commit/rollback ไปแล้วจะถูกข้าม)
+        """
+        amt = _to_minutes(actual_minutes)
+        with self._jobs_lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._release(job, amt)
+
+    def rollback(self, job_id: str) -> None:
+        """
+        งานล้มเหลว/ถูกยกเลิก: คืนนาทีที่กันไว้และปล่อยช่อง running job
+        """
+        with self._jobs_lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._release(job)
 
 
 # สร้างอินสแตนซ์เดียวให้ main.py import ไปใช้